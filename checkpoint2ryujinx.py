@@ -1,234 +1,547 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 import struct
-import shutil
+import hashlib
+import logging
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+log = logging.getLogger(__name__)
 
 def get_next_ryujinx_folder(base_directory):
     """
     Determines the next available folder name in the Ryujinx directory based on existing folders.
     Folder names are expected to be hexadecimal numbers.
     """
-    existing_folders = [folder for folder in os.listdir(base_directory) if os.path.isdir(os.path.join(base_directory, folder))]
-    if not existing_folders:
-        return "0000000000000001"  # Start with this if no folders exist
-    max_folder = max(int(folder, 16) for folder in existing_folders)
-    next_folder = format(max_folder + 1, '016x')
-    return next_folder
+    with os.scandir(base_directory) as entries:
+        max_folder = max((int(entry.name, 16) for entry in entries if entry.is_dir()), default=0)  # No folders yet means we start at 0000000000000001
+    return format(max_folder + 1, '016x')
 
 def extract_game_id(checkpoint_folder_name):
     """ Extracts the game ID from the Checkpoint folder name. """
     try:
-        game_id_hex = checkpoint_folder_name.split(' ')[0][2:]  # Typical format: "0x<game_id> <game_name>"
+        game_id_hex = checkpoint_folder_name.partition(' ')[0][2:]  # Typical format: "0x<game_id> <game_name>"
         formatted_game_id = f"{int(game_id_hex, 16):016x}"
-        print(f"Extracted game ID {formatted_game_id} from folder name {checkpoint_folder_name}")
+        log.debug("Extracted game ID %s from folder name %s", formatted_game_id, checkpoint_folder_name)
         return formatted_game_id
     except Exception as e:
-        print(f"Error extracting game ID from {checkpoint_folder_name}: {e}")
+        log.warning("Error extracting game ID from %s: %s", checkpoint_folder_name, e)
     return None
 
-def create_extradata0_file(game_id_hex, output_folder, user_id_hex="00000000000000010000000000000000", flags=b'\x00\x00\x00\x00', journal_size=b'\x10\x00\x00\x00', commit_id=b'\x00\x00\x00\x00\x00\x00\x00\x00'):
+DEFAULT_USER_ID_HEX = "00000000000000010000000000000000"
+DEFAULT_FLAGS = b'\x00\x00\x00\x00'
+DEFAULT_JOURNAL_SIZE = b'\x10\x00\x00\x00\x00\x00\x00\x00'
+DEFAULT_COMMIT_ID = b'\x00\x00\x00\x00\x00\x00\x00\x00'
+
+# ExtraData0 is 512 bytes, mostly zeros; only the game ID (offsets 0 and 64) changes between games with the default settings
+_EXTRADATA0_BASE = bytes(512)
+_EXTRADATA0_DEFAULT = bytearray(_EXTRADATA0_BASE)
+_EXTRADATA0_DEFAULT[8:24] = bytes.fromhex(DEFAULT_USER_ID_HEX)
+_EXTRADATA0_DEFAULT[80:84] = DEFAULT_FLAGS
+_EXTRADATA0_DEFAULT[96:104] = DEFAULT_JOURNAL_SIZE
+_EXTRADATA0_DEFAULT[104:112] = DEFAULT_COMMIT_ID
+_EXTRADATA0_DEFAULT = bytes(_EXTRADATA0_DEFAULT)
+
+def create_extradata0_file(game_id_hex, output_folder, user_id_hex=DEFAULT_USER_ID_HEX, flags=DEFAULT_FLAGS, journal_size=DEFAULT_JOURNAL_SIZE, commit_id=DEFAULT_COMMIT_ID):
     """
     Creates or updates the ExtraData0 file using the standard User ID from Ryujinx settings.
     """
-    game_id_bytes = bytes.fromhex(game_id_hex)
-    user_id_bytes = bytes.fromhex(user_id_hex)
-    game_id_little_endian = struct.pack('<Q', int.from_bytes(game_id_bytes, 'big'))
-    template = bytearray(512)
-    template[0:8] = game_id_little_endian
-    template[8:24] = user_id_bytes
-    template[64:72] = game_id_little_endian
-    template[80:84] = flags
-    template[96:104] = journal_size
-    template[104:112] = commit_id
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-    with open(os.path.join(output_folder, "ExtraData0"), 'wb') as f:
-        f.write(template)
+    game_id = int(game_id_hex, 16)
+    if user_id_hex == DEFAULT_USER_ID_HEX and flags == DEFAULT_FLAGS and journal_size == DEFAULT_JOURNAL_SIZE and commit_id == DEFAULT_COMMIT_ID:
+        template = bytearray(_EXTRADATA0_DEFAULT)
+    else:
+        template = bytearray(_EXTRADATA0_BASE)
+        template[8:24] = bytes.fromhex(user_id_hex)
+        template[80:84] = flags
+        template[96:104] = journal_size.ljust(8, b'\x00')  # Accept the 4 byte form too
+        template[104:112] = commit_id
+    struct.pack_into('<Q', template, 0, game_id)  # Game ID is stored little-endian
+    struct.pack_into('<Q', template, 64, game_id)
+    os.makedirs(output_folder, exist_ok=True)
+    fd = os.open(os.path.join(output_folder, "ExtraData0"), os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+    try:
+        os.write(fd, template)
+    finally:
+        os.close(fd)
 
 def get_latest_save_folder(checkpoint_game_folder):
-    backup_folders = [os.path.join(checkpoint_game_folder, folder) for folder in os.listdir(checkpoint_game_folder) if os.path.isdir(os.path.join(checkpoint_game_folder, folder))]
-    return max(backup_folders, key=os.path.getmtime, default=None)
+    with os.scandir(checkpoint_game_folder) as entries:
+        latest = max((entry for entry in entries if entry.is_dir()), key=lambda entry: entry.stat().st_mtime, default=None)
+    return latest.path if latest else None
+
+COPY_BUFFER_SIZE = 1 << 20  # Up to 1 MiB chunks for the read/write fallback
+
+def _fadvise(fd, size, *advice):
+    """ Passes POSIX_FADV_* access pattern hints (by name) to the kernel, where posix_fadvise exists. They're only hints, so failures are ignored. """
+    if hasattr(os, 'posix_fadvise'):
+        for name in advice:
+            try:
+                os.posix_fadvise(fd, 0, size, getattr(os, 'POSIX_FADV_' + name))
+            except OSError:
+                pass
 
-def copy_save_files(source_folder, destination_folder):
+FICLONE = 0x40049409  # _IOW(0x94, 9, int) from linux/fs.h
+CLONE_NOFOLLOW = 0x0001  # From macOS sys/clonefile.h
+
+def _try_reflink(src_fd, dst_fd):
+    """
+    Asks a copy-on-write filesystem (btrfs, XFS, ...) to share the source's data blocks with the destination instead of copying them.
+    Returns False when that isn't possible here (other OS, other filesystem, different mounts, ...).
+    """
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError:
+        return False
+    return True
+
+_libc = None
+
+def _try_clonefile(src_path, dst_path):
+    """
+    macOS counterpart of _try_reflink, making an APFS clone with clonefile().
+    The destination must not exist yet.
+    """
+    global _libc
+    if sys.platform != 'darwin':
+        return False
+    if _libc is None:
+        import ctypes
+        _libc = ctypes.CDLL(None, use_errno=True)
+    clonefile = getattr(_libc, 'clonefile', None)  # macOS 10.12+
+    if clonefile is None:
+        return False
+    return clonefile(os.fsencode(src_path), os.fsencode(dst_path), CLONE_NOFOLLOW) == 0
+
+def _copy_data(in_fd, out_fd, size):
+    """
+    Moves a file's contents between two open descriptors, letting the kernel do the work where possible.
+    Tries a copy-on-write clone first, then copy_file_range (Linux), then sendfile, then a plain read/write loop.
+    """
+    if size == 0:
+        return  # The destination was just truncated, an empty file needs nothing more
+    if _try_reflink(in_fd, out_fd):
+        return  # No data was read, so there's nothing for the cache hints below to do
+    # Read ahead aggressively, and drop the pages once copied so big saves don't push everything else out of the cache
+    _fadvise(in_fd, size, 'SEQUENTIAL', 'WILLNEED')
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while True:
+                sent = os.copy_file_range(in_fd, out_fd, max(size - copied, COPY_BUFFER_SIZE))
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError:
+            if copied:
+                raise
+            # Not supported here (old kernel, cross-filesystem, ...), fall through
+    if copied == 0 and hasattr(os, 'sendfile'):
+        try:
+            while True:
+                sent = os.sendfile(out_fd, in_fd, copied, max(size - copied, COPY_BUFFER_SIZE))
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError:
+            if copied:
+                raise
+    if copied == 0:
+        buffer = bytearray(min(size, COPY_BUFFER_SIZE))  # Most save files are much smaller than a full chunk
+        view = memoryview(buffer)
+        with open(in_fd, 'rb', buffering=0, closefd=False) as reader:
+            while True:
+                read = reader.readinto(buffer)
+                if not read:
+                    break
+                written = 0
+                while written < read:
+                    written += os.write(out_fd, view[written:read])
+    _fadvise(in_fd, size, 'DONTNEED')
+    _fadvise(out_fd, size, 'DONTNEED')
+
+def _fast_copy(src_path, dst_path, src_stat):
+    """
+    Copies a single regular file and its access/modification times, taken from src_stat.
+    Unlike shutil.copy2, permission bits, flags, extended attributes and ACLs are not copied; Ryujinx saves don't need them.
+    """
+    times = (src_stat.st_atime_ns, src_stat.st_mtime_ns)
+    if sys.platform == 'darwin':
+        try:
+            os.unlink(dst_path)  # clonefile() won't overwrite, and the copy below truncates it anyway
+        except FileNotFoundError:
+            pass
+        if _try_clonefile(src_path, dst_path):
+            os.utime(dst_path, ns=times)
+            return
+    size = src_stat.st_size
+    in_fd = os.open(src_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        out_fd = os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+        try:
+            _copy_data(in_fd, out_fd, size)
+            if os.utime in os.supports_fd:
+                os.utime(out_fd, ns=times)
+        finally:
+            os.close(out_fd)
+    finally:
+        os.close(in_fd)
+    if os.utime not in os.supports_fd:  # Windows
+        os.utime(dst_path, ns=times)
+
+_hash_buffers = threading.local()  # One read buffer per copy thread, reused for every file it hashes
+
+def _file_hash(path):
+    """ BLAKE2b digest of a file's contents. """
+    with open(path, 'rb', buffering=0) as file:
+        if hasattr(hashlib, 'file_digest'):  # Python 3.11+
+            return hashlib.file_digest(file, 'blake2b').digest()
+        buffer = getattr(_hash_buffers, 'buffer', None)
+        if buffer is None:
+            buffer = _hash_buffers.buffer = bytearray(COPY_BUFFER_SIZE)
+        view = memoryview(buffer)
+        digest = hashlib.blake2b()
+        while True:
+            read = file.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+        return digest.digest()
+
+def _is_same_file(src_path, src_stat, dst_path, compare_hash):
+    """
+    Tells whether the destination already holds the source file's contents.
+    By default matching size and modification time are enough; with compare_hash the contents are hashed instead.
+    """
+    try:
+        dst_stat = os.stat(dst_path, follow_symlinks=False)
+    except FileNotFoundError:
+        return False
+    if dst_stat.st_size != src_stat.st_size:
+        return False
+    if compare_hash:
+        return _file_hash(src_path) == _file_hash(dst_path)
+    return dst_stat.st_mtime_ns == src_stat.st_mtime_ns
+
+def copy_save_files(source_folder, destination_folder, compare_hash=False):
     """
     Copies all files and directories from the source folder to the destination folder.
+    Files the destination already has are skipped, see _is_same_file.
     """
-    for item in os.listdir(source_folder):
-        src_path = os.path.join(source_folder, item)
-        dst_path = os.path.join(destination_folder, item)
-        if os.path.isdir(src_path):
-            shutil.copytree(src_path, dst_path, dirs_exist_ok=True)
-        else:
-            shutil.copy2(src_path, dst_path)
+    stack = [(source_folder, destination_folder)]
+    while stack:
+        src_dir, dst_dir = stack.pop()
+        os.makedirs(dst_dir, exist_ok=True)
+        with os.scandir(src_dir) as entries:
+            for entry in entries:
+                dst_path = os.path.join(dst_dir, entry.name)
+                if entry.is_dir():
+                    stack.append((entry.path, dst_path))
+                elif entry.is_file():
+                    src_stat = entry.stat()
+                    if _is_same_file(entry.path, src_stat, dst_path, compare_hash):
+                        continue
+                    _fast_copy(entry.path, dst_path, src_stat)
 
-def read_game_id_from_extradata0(extra_data0_path, expected_game_id):
-    """ Reads the game ID from an ExtraData0 file and compares it with the expected ID. """
+def read_game_id_from_extradata0(extra_data0_path):
+    """ Reads the game ID from an ExtraData0 file. """
     try:
-        with open(extra_data0_path, 'rb') as file:
-            game_id_bytes = file.read(8)  # Read the first 8 bytes
-            if game_id_bytes:
-                game_id = struct.unpack('<Q', game_id_bytes)[0]
-                formatted_game_id = f"{game_id:016x}"
-                if formatted_game_id == expected_game_id:
-                    print(f"Match found: Game ID {formatted_game_id} in {extra_data0_path}")
-                # else:
-                #     print(f"No match: Read {formatted_game_id}, expected {expected_game_id}")  # Debugging why no match
-                return formatted_game_id
-    except Exception as e:
-        print(f"Error reading {extra_data0_path}: {e}")
-    return None
+        fd = os.open(extra_data0_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    except (FileNotFoundError, NotADirectoryError):
+        return None  # No ExtraData0 here, nothing to report
+    except OSError as e:
+        log.warning("Error reading %s: %s", extra_data0_path, e)
+        return None
+    try:
+        game_id_bytes = os.read(fd, 8)  # Read the first 8 bytes
+    except OSError as e:
+        log.warning("Error reading %s: %s", extra_data0_path, e)
+        return None
+    finally:
+        os.close(fd)
+    if len(game_id_bytes) < 8:
+        return None
+    game_id, = struct.unpack_from('<Q', game_id_bytes)
+    return f"{game_id:016x}"
+
+def build_game_id_index(save_data_directory):
+    """ Maps every game ID found in the Ryujinx save folders' ExtraData0 files to its save folder path. """
+    game_id_index = {}
+    # Local names for everything the loop touches, it runs once per Ryujinx save folder
+    extra_data0_suffix = os.sep + 'ExtraData0'
+    read_game_id = read_game_id_from_extradata0
+    add_to_index = game_id_index.setdefault
+    with os.scandir(save_data_directory) as save_folders:
+        for save_folder in save_folders:
+            folder_path = save_folder.path
+            game_id_hex = read_game_id(folder_path + extra_data0_suffix)
+            if game_id_hex:
+                add_to_index(game_id_hex, folder_path)  # Keep the first match, like the old per-game scan
+    return game_id_index
+
+def _pack_imen_records(buf, offset, items):
+    """ Packs (key, value) pairs as consecutive IMEN records into buf, starting at offset. """
+    for k, v in items:
+        struct.pack_into('<4sII', buf, offset, b'IMEN', len(k), len(v))
+        offset += 12
+        buf[offset:offset + len(k)] = k
+        offset += len(k)
+        buf[offset:offset + len(v)] = v
+        offset += len(v)
+
+def build_imen_records(items):
+    """ Packs (key, value) pairs into consecutive IMEN records. """
+    buf = bytearray(sum(12 + len(k) + len(v) for k, v in items))
+    _pack_imen_records(buf, 0, items)
+    return buf
+
+def build_imkvdb(entries):
+    """ Builds the whole IMKVDB file image (header plus one IMEN record per entry) in a single buffer. """
+    buf = bytearray(12 + sum(12 + len(k) + len(v) for k, v in entries.items()))
+    struct.pack_into('<4s4xI', buf, 0, b'IMKV', len(entries))
+    _pack_imen_records(buf, 12, entries.items())
+    return buf
+
+ZEROS_24 = b'\x00' * 24
+ZEROS_32 = b'\x00' * 32
+ZEROS_56 = b'\x00' * 56
 
 def populate_system_folders(imkvdb_path, system_save_directory):
     entries = {}
-    print(f"Scanning for system folders in: {system_save_directory}")
+    log.info("Scanning for system folders in: %s", system_save_directory)
     try:
-        folders = os.listdir(system_save_directory)
+        folders = os.scandir(system_save_directory)
     except FileNotFoundError:
-        print(f"Directory not found: {system_save_directory}")
+        log.warning("Directory not found: %s", system_save_directory)
         return
 
-    for folder in folders:
-        if len(folder) == 16:  # Assuming system save folders have 16 character names (hex)
+    debug = log.isEnabledFor(logging.DEBUG)  # Checked once, so the hex dumps below are only built when they'll be shown
+    with folders:
+        for folder in folders:
+            if len(folder.name) != 16:  # Assuming system save folders have 16 character names (hex)
+                if debug:
+                    log.debug("Skipped folder %s due to incorrect name length", folder.name)
+                continue
             try:
-                folder_id = int(folder, 16)
-                # Use '<Q' for 64-bit unsigned long long
-                key = (b'\x00' * 24) + struct.pack('<Q', folder_id) + (b'\x00' * 32)
-                value = struct.pack('<Q', folder_id) + (b'\x00' * 56)
-                entries[key] = value
-                print(f"Adding system folder {folder} to imkvdb.arc: Key: {key.hex()}, Value: {value.hex()}")
+                folder_id = int(folder.name, 16)
             except ValueError:
                 # Ignore folders with non-hexadecimal names
                 continue
-        else:
-            print(f"Skipped folder {folder} due to incorrect name length")
+            # Use '<Q' for 64-bit unsigned long long
+            folder_id_bytes = struct.pack('<Q', folder_id)
+            key = ZEROS_24 + folder_id_bytes + ZEROS_32
+            value = folder_id_bytes + ZEROS_56
+            entries[key] = value
+            if debug:
+                log.debug("Adding system folder %s to imkvdb.arc: Key: %s, Value: %s", folder.name, key.hex(), value.hex())
 
     # Write entries to imkvdb.arc
     if entries:
         with open(imkvdb_path, 'wb') as file:
-            file.write(b'IMKV' + b'\x00' * 4 + struct.pack('<I', len(entries)))
-            for k, v in entries.items():
-                file.write(b'IMEN' + struct.pack('<I', len(k)) + struct.pack('<I', len(v)) + k + v)
-        print(f"imkvdb.arc created with {len(entries)} entries.")
-    else:
-        print("No valid system folders found to add to imkvdb.arc.")
-
-def initialize_imkvdb(imkvdb_path, system_save_directory):
-    """ Initialize a new IMKVDB file if it does not exist and populate it with system save folders. """
-    if not os.path.exists(imkvdb_path):
-        print(f"imkvdb.arc does not exist. Creating new file at {imkvdb_path}.")
-        populate_system_folders(imkvdb_path, system_save_directory)
+            file.write(build_imkvdb(entries))
+        log.info("imkvdb.arc created with %d entries.", len(entries))
     else:
-        print(f"imkvdb.arc already exists at {imkvdb_path}.")
+        log.warning("No valid system folders found to add to imkvdb.arc.")
 
 def initialize_imkvdb(imkvdb_path, system_save_directory):
     """ Initialize a new IMKVDB file if it does not exist and populate it with system save folders. """
-    if not os.path.exists(imkvdb_path):
-        populate_system_folders(imkvdb_path, system_save_directory)
-    else:
-        # If the file already exists, simply check for consistency or update logic here if needed
-        pass
+    if os.path.exists(imkvdb_path):
+        return  # Already there, no need to scan the system saves again
+    log.info("imkvdb.arc does not exist. Creating new file at %s.", imkvdb_path)
+    populate_system_folders(imkvdb_path, system_save_directory)
 
-def parse_imkvdb(file_path):
-    """ Parse the existing IMKVDB file into a dictionary of keys and values. """
+def _parse_imkvdb_records(file_path):
+    """ Parses an IMKVDB file, returning its entries and the offset where the last valid record ends. """
     entries = {}
     try:
         with open(file_path, 'rb') as file:
-            header = file.read(12)  # Read the header which includes the magic 'IMKV', reserved and number of entries
-            if header[:4] != b'IMKV':
-                return entries  # Not a valid IMKVDB file
-            num_entries = struct.unpack('<I', header[8:12])[0]
-            for _ in range(num_entries):
-                if file.read(4) != b'IMEN':
-                    break  # Invalid entry header
-                key_size = struct.unpack('<I', file.read(4))[0]
-                value_size = struct.unpack('<I', file.read(4))[0]
-                key = file.read(key_size)
-                value = file.read(value_size)
-                entries[key] = value
+            data = file.read()  # Read it all at once, the file is small
     except FileNotFoundError:
-        pass  # File not found, return empty dict
-    return entries
+        return entries, 0  # File not found, return empty dict
+    if data[:4] != b'IMKV' or len(data) < 12:
+        return entries, 0  # Not a valid IMKVDB file
+    view = memoryview(data)
+    num_entries = struct.unpack_from('<I', view, 8)[0]
+    unpack_entry_header = struct.Struct('<4sII').unpack_from
+    end = len(data)
+    offset = 12
+    for _ in range(num_entries):
+        if offset + 12 > end:
+            break  # Truncated file
+        magic, key_size, value_size = unpack_entry_header(view, offset)
+        if magic != b'IMEN':
+            break  # Invalid entry header
+        key_start = offset + 12
+        value_start = key_start + key_size
+        record_end = value_start + value_size
+        if record_end > end:
+            break  # Truncated file
+        entries[bytes(view[key_start:value_start])] = bytes(view[value_start:record_end])
+        offset = record_end
+    return entries, offset
 
-def update_imkvdb(file_path, game_id_hex, folder_id):
-    entries = parse_imkvdb(file_path)
+def parse_imkvdb(file_path):
+    """ Parse the existing IMKVDB file into a dictionary of keys and values. """
+    return _parse_imkvdb_records(file_path)[0]
 
+def make_imkvdb_entry(game_id_hex, folder_id):
+    """ Builds the IMKVDB key and value mapping a game ID to its save folder index. """
     # Normalize the game ID hex string to lower case
     game_id_hex = game_id_hex.lower()
     folder_id_bytes = struct.pack('<Q', folder_id)  # Folder ID in little-endian format
 
     if int(game_id_hex, 16) == 0:  # Assuming system entry logic needs no '1' in the key
-        key = (b'\x00' * 24) + folder_id_bytes + (b'\x00' * 32)
+        key = ZEROS_24 + folder_id_bytes + ZEROS_32
         value = folder_id_bytes + (b'\x00' * 60) + b'\x01' + (b'\x00' * 3)
     else:  # Game entry
-        game_id_bytes = bytes.fromhex(game_id_hex)
         game_id_little_endian = struct.pack('<Q', int(game_id_hex, 16))
         # Ensure the game ID is in little endian for the key
         key = game_id_little_endian + b'\x01' + (b'\x00' * 23) + b'\x01' + (b'\x00' * 31)
         value = folder_id_bytes + (b'\x00' * 16) + b'\x01' + (b'\x00' * 39)
+    return key, value
+
+class ImkvDb:
+    """ In-memory copy of an IMKVDB file, parsed once and written back with flush(). """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries, self._saved_end = _parse_imkvdb_records(path)
+        self.dirty = False
+        self._saved_count = len(self.entries)  # Entries already on disk, new ones get appended after them
+
+    def add(self, key, value):
+        """ Adds the entry if its key is not there yet. Returns whether it was added. """
+        if key in self.entries:
+            return False
+        self.entries[key] = value
+        self.dirty = True
+        return True
+
+    def add_game(self, game_id_hex, folder_id):
+        key, value = make_imkvdb_entry(game_id_hex, folder_id)
+        if self.add(key, value):
+            log.info("Updated imkvdb.arc with new entry for Game ID %s at folder index %d", game_id_hex.lower(), folder_id)
+        else:
+            log.debug("Entry for Game ID %s already exists in imkvdb.arc, no update needed.", game_id_hex.lower())
 
-    # Only update if key does not exist
-    if key not in entries:
-        entries[key] = value
-        with open(file_path, 'wb') as file:
-            file.write(b'IMKV' + b'\x00' * 4 + struct.pack('<I', len(entries)))  # Write header
-            for k, v in entries.items():
-                file.write(b'IMEN' + struct.pack('<I', len(k)) + struct.pack('<I', len(v)) + k + v)
-        print(f"Updated imkvdb.arc with new entry for Game ID {game_id_hex} at folder index {folder_id}")
+    def flush(self):
+        """
+        Writes pending entries to disk.
+        New records are appended to the end of the file and only the entry count in the header is rewritten,
+        unless the file is missing, no longer matches what was loaded, or has anything after its last record
+        (which would hide the appended ones), in which case it's written from scratch.
+        """
+        if not self.dirty:
+            return
+        new_entries = list(self.entries.items())[self._saved_count:]
+        appended = False
+        try:
+            with open(self.path, 'r+b') as file:
+                header = file.read(12)
+                if (header[:4] == b'IMKV' and struct.unpack('<I', header[8:12])[0] == self._saved_count
+                        and file.seek(0, os.SEEK_END) == self._saved_end):
+                    block = build_imen_records(new_entries)
+                    file.write(block)
+                    file.seek(8)
+                    file.write(struct.pack('<I', len(self.entries)))
+                    self._saved_end += len(block)
+                    appended = True
+        except FileNotFoundError:
+            pass
+        if not appended:
+            image = build_imkvdb(self.entries)
+            with open(self.path, 'wb') as file:
+                file.write(image)
+            self._saved_end = len(image)
+        self._saved_count = len(self.entries)
+        self.dirty = False
+
+def resolve_output_folder(game_id_hex, save_data_directory, game_id_index):
+    """ Returns the Ryujinx save folder for a game ID, creating it with its ExtraData0 file if there isn't one yet. """
+    output_folder = game_id_index.get(game_id_hex)
+    if output_folder:
+        log.debug("Match found: Game ID %s in %s", game_id_hex, output_folder)
     else:
-        print(f"Entry for Game ID {game_id_hex} already exists in imkvdb.arc, no update needed.")
+        next_folder_id = get_next_ryujinx_folder(save_data_directory)
+        output_folder = os.path.join(save_data_directory, next_folder_id)
+        create_extradata0_file(game_id_hex, output_folder)
+        game_id_index[game_id_hex] = output_folder
+    return output_folder
+
+def import_checkpoint_game(folder_path, output_folder, compare_hash=False):
+    """ Copies the latest Checkpoint backup of one game into its Ryujinx save folder. """
+    final_destination = os.path.join(output_folder, '0')
+    os.makedirs(final_destination, exist_ok=True)
 
-def ensure_imkvdb_entry(game_id_hex, folder_id, imkvdb_path):
-    """ Ensure the game ID to folder mapping exists in the IMKVDB file. """
-    initialize_imkvdb(imkvdb_path)  # Ensure file exists and is initialized
-    update_imkvdb(imkvdb_path, game_id_hex, folder_id)
+    latest_save_folder = get_latest_save_folder(folder_path)
+    if latest_save_folder:
+        copy_save_files(latest_save_folder, final_destination, compare_hash)
 
-def main(checkpoint_base_directory, ryujinx_base_directory):
+def main(checkpoint_base_directory, ryujinx_base_directory, compare_hash=False):
     save_data_directory = os.path.join(ryujinx_base_directory, "bis/user/save")
     imkvdb_path = os.path.join(ryujinx_base_directory, "bis/system/save/8000000000000000/0/imkvdb.arc")
 
-    for folder in os.listdir(checkpoint_base_directory):
-        folder_path = os.path.join(checkpoint_base_directory, folder)
-        if os.path.isdir(folder_path):
-            game_id_hex = extract_game_id(folder)
-            if game_id_hex:
-                output_folder = None
-
-                # Check existing Ryujinx folders for this game ID
-                for save_folder in os.listdir(save_data_directory):
-                    extra_data0_path = os.path.join(save_data_directory, save_folder, 'ExtraData0')
-                    if os.path.exists(extra_data0_path):
-                        existing_game_id = read_game_id_from_extradata0(extra_data0_path, game_id_hex)
-                        if existing_game_id == game_id_hex:
-                            output_folder = os.path.join(save_data_directory, save_folder)
-                            break
-
-                if not output_folder:
-                    next_folder_id = get_next_ryujinx_folder(save_data_directory)
-                    output_folder = os.path.join(save_data_directory, next_folder_id)
-                    create_extradata0_file(game_id_hex, output_folder)
-
-                final_destination = os.path.join(output_folder, '0')
-                if not os.path.exists(final_destination):
-                    os.makedirs(final_destination)
-
-                latest_save_folder = get_latest_save_folder(folder_path)
-                if latest_save_folder:
-                    copy_save_files(latest_save_folder, final_destination)
-
-                # Convert folder ID from hexadecimal string to integer
-                folder_id = int(os.path.basename(output_folder), 16)
-                update_imkvdb(imkvdb_path, game_id_hex, folder_id)
+    # Scan the existing Ryujinx folders once, instead of once per Checkpoint game
+    game_id_index = build_game_id_index(save_data_directory)
+
+    # Folders are picked here, in listing order, so their numbering doesn't depend on thread timing.
+    # Only the copies, which are mostly waiting on the disk, run in parallel threads.
+    imports = {}  # future -> (Checkpoint folder name, game ID, folder ID)
+    imported_game_ids = {}
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+        with os.scandir(checkpoint_base_directory) as checkpoint_folders:
+            for folder in checkpoint_folders:
+                if folder.is_dir():
+                    game_id_hex = extract_game_id(folder.name)
+                    if not game_id_hex:
+                        continue
+                    if game_id_hex in imported_game_ids:
+                        # Two copies into the same save folder would clobber each other
+                        log.warning("Skipping %s, Game ID %s is already imported from %s", folder.name, game_id_hex, imported_game_ids[game_id_hex])
+                        continue
+                    imported_game_ids[game_id_hex] = folder.name
+                    output_folder = resolve_output_folder(game_id_hex, save_data_directory, game_id_index)
+                    # Convert folder ID from hexadecimal string to integer
+                    folder_id = int(os.path.basename(output_folder), 16)
+                    future = executor.submit(import_checkpoint_game, folder.path, output_folder, compare_hash)
+                    imports[future] = (folder.name, game_id_hex, folder_id)
+
+        failed = set()
+        for future in as_completed(imports):
+            try:
+                future.result()
+            except Exception as e:
+                log.error("Error importing %s: %s", imports[future][0], e)
+                failed.add(future)
+
+    # imkvdb.arc is only written from here, after all copies are done, in the same order the folders were picked
+    imkvdb = ImkvDb(imkvdb_path)
+    for future, (_, game_id_hex, folder_id) in imports.items():
+        if future not in failed:
+            imkvdb.add_game(game_id_hex, folder_id)
+    imkvdb.flush()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Import save games to Ryujinx")
     parser.add_argument('-c', '--checkpoint', required=True, help='Path to the Checkpoint base directory')
     parser.add_argument('-r', '--ryujinx', required=True, help='Path to the Ryujinx base directory')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Show debug output for every folder and entry processed')
+    parser.add_argument('--hash', action='store_true', help='Compare file contents (BLAKE2b) instead of size and modification time to skip unchanged files')
     args = parser.parse_args()
 
+    logging.basicConfig(stream=sys.stdout, format='%(message)s', level=logging.DEBUG if args.verbose else logging.INFO)
+
     system_save_directory = os.path.join(args.ryujinx, "bis/system/save")
     imkvdb_path = os.path.join(args.ryujinx, "bis/system/save/8000000000000000/0/imkvdb.arc")
 
     initialize_imkvdb(imkvdb_path, system_save_directory)
-    main(args.checkpoint, args.ryujinx)
+    main(args.checkpoint, args.ryujinx, args.hash)